@@ -1,13 +1,27 @@
 import asyncio
 import os
+import shutil
+import threading
+from collections.abc import AsyncIterator, Iterator
 from pathlib import Path
 
 import streamlit as st
-from agents import Agent, Runner, ToolCallItem
-from openai import OpenAI
+from agents import (
+    Agent,
+    OpenAIResponsesModel,
+    Runner,
+    ToolCallItem,
+    set_tracing_export_api_key,
+)
 from dotenv import load_dotenv
 
-from funes.agent import list_memory_files, read_memory_file
+from funes.agent import (
+    MEMORY_TOOLS,
+    get_client,
+    has_memory_files,
+    scan_memory_files,
+    stream_base_response,
+)
 
 load_dotenv()
 
@@ -16,31 +30,25 @@ MEM_DIR = Path.cwd() / "memory"
 OPENAI_MODELS = ["gpt-4o", "gpt-4o-mini", "gpt-4.1", "gpt-4.1-mini", "o3", "o4-mini"]
 
 
-def get_base_response(prompt: str, model: str, api_key: str) -> str:
-    """Get a baseline response from the model without memory tools."""
-    client = OpenAI(api_key=api_key)
-    response = client.responses.create(model=model, input=prompt)
-    return response.output_text
-
-
 async def get_agent_response(
     prompt: str, model: str, api_key: str
 ) -> tuple[str, list[dict]]:
     """Get response from agent with memory tools."""
-    # Set API key in environment for the agents library
-    os.environ["OPENAI_API_KEY"] = api_key
-
     agent = Agent(
         name="funes",
         instructions="""You are a helpful assistant that can access additional information stored in memory files. 
         You should ALWAYS call the list_memory_files tool to see if any are relevant to the user's query. 
-        If you find relevant files, use the read_memory_file tool to read their contents.""",
-        tools=[list_memory_files, read_memory_file],
-        model=model,
+        If you find relevant files, use the read_memory_file tool to read their contents,
+        or the read_memory_files tool to read several of them at once.
+        If there are many memory files, use the list_memory_dir tool to browse
+        one directory at a time.""",
+        tools=MEMORY_TOOLS,
+        # Pass the key through an explicit client rather than the environment
+        model=OpenAIResponsesModel(model=model, openai_client=get_client(api_key)),
     )
 
     runner = Runner()
-    response = await runner.run(agent, input=prompt)
+    response = await runner.run(agent, input=prompt, context={})
 
     output_text = response.final_output
     new_items = response.new_items
@@ -53,13 +61,46 @@ async def get_agent_response(
     return output_text, tool_calls
 
 
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Get the event loop shared by all sessions, running on its own thread.
+
+    A single long-lived loop lets the shared OpenAI client keep its connections
+    across submissions and sessions, and there is nothing to close per session.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="funes-loop", daemon=True).start()
+    return loop
+
+
+def iterate_on_loop(
+    loop: asyncio.AbstractEventLoop, stream: AsyncIterator[str]
+) -> Iterator[str]:
+    """Iterate an async stream synchronously, awaiting each chunk on loop."""
+
+    async def next_chunk() -> str:
+        return await stream.__anext__()
+
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(next_chunk(), loop).result()
+        except StopAsyncIteration:
+            return
+
+
+@st.cache_data(ttl=5, show_spinner=False)
+def get_memory_files(memory_dir: str, mtime_ns: int) -> list[str]:
+    """List memory files, cached on the memory directory's mtime."""
+    return scan_memory_files(memory_dir)
+
+
 def save_uploaded_file(uploaded_file, memory_dir: Path) -> str:
-    """Save an uploaded file to the memory directory."""
+    """Save an uploaded file to the (existing) memory directory."""
     file_path = memory_dir / uploaded_file.name
-    file_path.parent.mkdir(parents=True, exist_ok=True)
 
+    uploaded_file.seek(0)
     with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+        shutil.copyfileobj(uploaded_file, f, length=1 << 20)
 
     return str(file_path.relative_to(memory_dir))
 
@@ -78,6 +119,8 @@ def main():
         api_key = st.text_input(
             "OpenAI API Key", type="password", help="Enter your OpenAI API key", value=os.getenv("OPENAI_API_KEY", "")
         )
+        if api_key:
+            set_tracing_export_api_key(api_key)
 
         # Model selection
         model = st.selectbox(
@@ -99,7 +142,7 @@ def main():
         )
 
         if uploaded_files:
-            MEM_DIR.mkdir(exist_ok=True)
+            MEM_DIR.mkdir(parents=True, exist_ok=True)
             for uploaded_file in uploaded_files:
                 relative_path = save_uploaded_file(uploaded_file, MEM_DIR)
                 st.success(f"Saved: {relative_path}")
@@ -107,29 +150,29 @@ def main():
         # Display current memory files
         if MEM_DIR.exists():
             try:
-                memory_files = MEM_DIR.glob("**/*")
-                memory_files = [
-                    str(file.relative_to(MEM_DIR))
-                    for file in memory_files
-                    if file.is_file() and not file.name.startswith(".")
-                ]
-                memory_files.sort()
+                memory_files = get_memory_files(
+                    str(MEM_DIR), MEM_DIR.stat().st_mtime_ns
+                )
                 if memory_files:
                     st.subheader("Current Memory Files")
-                    for file in memory_files:
-                        if st.button(f"📄 {file}", key=f"file_{file}"):
-                            try:
-                                content = (MEM_DIR / Path(file)).read_text(
-                                    encoding="utf-8"
-                                )
-                                st.text_area(
-                                    f"Contents of {file}",
-                                    content,
-                                    height=200,
-                                    key=f"content_{file}",
-                                )
-                            except Exception as e:
-                                st.error(f"Error reading {file}: {e}")
+                    file = st.selectbox(
+                        "Preview file",
+                        memory_files,
+                        index=None,
+                        format_func=lambda f: f"📄 {f}",
+                        placeholder=f"{len(memory_files)} files",
+                    )
+                    if file:
+                        try:
+                            content = (MEM_DIR / Path(file)).read_text(encoding="utf-8")
+                            st.text_area(
+                                f"Contents of {file}",
+                                content,
+                                height=200,
+                                key=f"content_{file}",
+                            )
+                        except Exception as e:
+                            st.error(f"Error reading {file}: {e}")
                 else:
                     st.info("No memory files found")
             except Exception as e:
@@ -154,22 +197,37 @@ def main():
             return
 
         with st.spinner("Generating responses..."):
+            agent_future = None
             try:
+                loop = get_event_loop()
+                # The agent runs on the shared loop while the baseline is being
+                # streamed below. With no memory files it could only list an
+                # empty directory, so skip it and reuse the baseline.
+                if has_memory_files():
+                    agent_future = asyncio.run_coroutine_threadsafe(
+                        get_agent_response(prompt, model, api_key), loop
+                    )
+
                 # Create two columns for side-by-side comparison
                 col1, col2 = st.columns(2)
 
                 with col1:
                     st.subheader("🤖 Baseline Response")
                     with st.container():
-                        baseline_response = get_base_response(prompt, model, api_key)
-                        st.markdown(baseline_response)
+                        baseline_response = st.write_stream(
+                            iterate_on_loop(
+                                loop, stream_base_response(prompt, model, api_key)
+                            )
+                        )
 
                 with col2:
                     st.subheader("🧠 Agent Response (with Memory)")
                     with st.container():
-                        agent_response, tool_calls = asyncio.run(
-                            get_agent_response(prompt, model, api_key)
-                        )
+                        if agent_future is None:
+                            st.info("No memory files found, showing the baseline")
+                            agent_response, tool_calls = baseline_response, []
+                        else:
+                            agent_response, tool_calls = agent_future.result()
                         st.markdown(agent_response)
 
                         if tool_calls:
@@ -186,6 +244,10 @@ def main():
             except Exception as e:
                 st.error(f"Error generating responses: {e}")
                 st.exception(e)
+            finally:
+                # Stop the agent if the baseline failed before it was awaited
+                if agent_future is not None:
+                    agent_future.cancel()
 
 
 if __name__ == "__main__":
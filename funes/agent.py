@@ -1,71 +1,363 @@
 import asyncio
+import dataclasses
+import json
+import os
+import stat
+import threading
+from collections.abc import AsyncIterator, Iterator
 from pathlib import Path
+from typing import Any, Optional, Union
 
-from agents import Agent, Runner, ToolCallItem, function_tool
-from openai import OpenAI
+import httpx
+from agents import (
+    Agent,
+    FunctionTool,
+    OpenAIResponsesModel,
+    Runner,
+    RunResult,
+    ToolCallItem,
+    function_tool,
+)
+from agents.tool import default_tool_error_function
+from agents.tool_context import ToolContext
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from openai.types.responses import Response
 
 MEM_DIR = Path.cwd() / "memory"
+# Longest file content returned to the model by a read tool, in characters
+MAX_TOOL_CHARS = 32_000
+# Larger files are read from disk every time rather than kept in the read cache
+MAX_CACHED_BYTES = 1 << 20
+# Total file size kept in the read cache before least recently used files go
+MAX_CACHE_BYTES = 16 << 20
+# Set FUNES_FAST_PATHS=1 to only normalize requested paths instead of resolving
+# symlinks when checking that they stay inside MEM_DIR. Symlinks in memory/
+# can then point anywhere on disk.
+FAST_PATHS = os.getenv("FUNES_FAST_PATHS", "") not in ("", "0")
+# Most API keys with a cached client; the least recently used one is dropped
+MAX_CLIENTS = 4
+# API key -> (event loop, client), least recently used first
+_clients: dict[Optional[str], tuple[asyncio.AbstractEventLoop, AsyncOpenAI]] = {}
+# Keeps close() tasks of evicted clients alive until they finish
+_closing: set[asyncio.Task] = set()
+# (MEM_DIR, its resolved path), so reads don't resolve MEM_DIR every time
+_mem_root_cache: Optional[tuple[Path, str]] = None
 
+# (directory mtimes, sorted listing) from the last list_memory_files scan
+_list_cache: Optional[tuple[dict[str, int], list[str]]] = None
+# Resolved path -> (mtime_ns, size, text), least recently used first
+_read_cache: dict[str, tuple[int, int, str]] = {}
+_read_cache_bytes = 0
+# Reads run on worker threads, so the read cache is updated under this lock
+_read_cache_lock = threading.Lock()
 
-def base_response(prompt: str, model: str = "gpt-4.1") -> str:
+
+def get_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    """Get the AsyncOpenAI client shared by calls with the same API key.
+
+    Reusing one client keeps its connections to the API alive between
+    requests. Clients are bound to the event loop they were created on, so
+    calling from a different loop replaces (and closes) the cached client.
+    Clients evicted to stay within MAX_CLIENTS are only dropped, not closed,
+    since another session on the same loop may still be using them.
+
+    Args:
+        api_key: OpenAI API key, or None to read it from the environment
+    """
+    loop = asyncio.get_running_loop()
+    cached = _clients.pop(api_key, None)
+    if cached is not None:
+        if cached[0] is loop:
+            # Re-insert to mark it as most recently used
+            _clients[api_key] = cached
+            return cached[1]
+        _close_client(*cached)
+
+    client = AsyncOpenAI(
+        api_key=api_key,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        ),
+    )
+    _clients[api_key] = (loop, client)
+    while len(_clients) > MAX_CLIENTS:
+        # Runs holding this client keep it alive until they finish
+        del _clients[next(iter(_clients))]
+    return client
+
+
+def _close_client(loop: asyncio.AbstractEventLoop, client: AsyncOpenAI) -> None:
+    """Close a dropped client's connections on the loop that owns them."""
+    if loop.is_closed():
+        # Its connections went with the loop
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is running:
+        task = loop.create_task(client.close())
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+    else:
+        asyncio.run_coroutine_threadsafe(client.close(), loop)
+
+
+async def stream_base_response(
+    prompt: str, model: str = "gpt-4.1", api_key: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Stream a baseline response from the model without memory tools.
+
+    Yields:
+        Chunks of response text as they arrive.
+    """
+    client = get_client(api_key)
+    stream = await client.responses.create(model=model, input=prompt, stream=True)
+    async for event in stream:
+        if event.type == "response.output_text.delta":
+            yield event.delta
+
+
+async def base_response(prompt: str, model: str = "gpt-4.1") -> str:
     """Get a baseline response from the model without memory tools."""
-    client = OpenAI()
-    response = client.responses.create(model=model, input=prompt)
-    return response.output_text
+    return "".join([chunk async for chunk in stream_base_response(prompt, model)])
 
 
-# function tools
-@function_tool
-def list_memory_files() -> list[str]:
-    """List all memory files recursively from the memory directory.
+def iter_memory_files(
+    root: str, dir_mtimes: Optional[dict[str, int]] = None
+) -> Iterator[str]:
+    """Recursively yield non-hidden files under root, in no particular order.
+
+    Paths are yielded as the walk finds them, so callers that only need some
+    of the files (e.g. via itertools.islice) don't pay for the whole tree.
+
+    Args:
+        root: Directory to scan, without a trailing separator
+        dir_mtimes: If given, filled with the mtime of every directory walked,
+            taken before the directory is read
+
+    Yields:
+        File paths relative to root.
+    """
+    prefix_len = len(root) + 1
+    if dir_mtimes is not None:
+        dir_mtimes[root] = os.stat(root).st_mtime_ns
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                # Directory entry names are never empty
+                if entry.name[0] == ".":
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if dir_mtimes is not None:
+                        mtime_ns = entry.stat(follow_symlinks=False).st_mtime_ns
+                        dir_mtimes[entry.path] = mtime_ns
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path[prefix_len:]
+
+
+def scan_memory_files(root: str) -> list[str]:
+    """Recursively list non-hidden files under root.
+
+    Args:
+        root: Directory to scan, without a trailing separator
 
     Returns:
-        List of relative file paths from the memory directory.
+        Sorted list of file paths relative to root.
     """
-    if not MEM_DIR.exists():
-        MEM_DIR.mkdir(exist_ok=True)
-        return []
+    return sorted(iter_memory_files(root))
 
-    files = MEM_DIR.glob("**/*")
-    files = [
-        str(file.relative_to(MEM_DIR))
-        for file in files
-        if file.is_file() and not file.name.startswith(".")
-    ]
-    files.sort()
-    return files
 
+async def batch_base_responses(
+    prompts: list[str],
+    model: str = "gpt-4.1",
+    poll_interval: float = 10.0,
+    max_poll_interval: float = 300.0,
+) -> list[str]:
+    """Get baseline responses for many prompts through the Batch API.
 
-@function_tool
-def read_memory_file(path: str) -> str:
-    """Read a memory file by its relative path.
+    Batched requests are billed at half price, but the batch may take a while
+    to complete.
 
     Args:
-        path: Relative path from the memory directory
+        prompts: Prompts to answer
+        model: Model to use for every prompt
+        poll_interval: Seconds to wait before the first batch status check;
+            the wait doubles after each check
+        max_poll_interval: Upper bound on the wait between status checks
 
     Returns:
-        File contents as UTF-8 string
+        Response texts, in the same order as prompts. A prompt whose request
+        failed gets "Error: <reason>" instead, so one failure does not lose
+        the other responses.
+    """
+    if not prompts:
+        return []
+
+    client = get_client()
+    lines = [
+        json.dumps(
+            {
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/responses",
+                "body": {"model": model, "input": prompt},
+            }
+        )
+        for i, prompt in enumerate(prompts)
+    ]
+    batch_file = await client.files.create(
+        file=("baselines.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch",
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/responses",
+        completion_window="24h",
+    )
+
+    delay = poll_interval
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+
+    # Successful requests land in the output file and failed ones in the error
+    # file; an expired or cancelled batch can still have both
+    texts = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id is None:
+            continue
+        content = await client.files.content(file_id)
+        for line in content.text.splitlines():
+            result = json.loads(line)
+            texts[result["custom_id"]] = _batch_result_text(result)
+
+    # Prompts without a result never ran, e.g. because the batch failed
+    # validation; report why the batch stopped
+    reason = f"no result from batch {batch.id}, which ended as {batch.status}"
+    if batch.errors and batch.errors.data:
+        reason += ": " + "; ".join(
+            e.message or e.code or "unknown error" for e in batch.errors.data
+        )
+    return [texts.get(str(i), f"Error: {reason}") for i in range(len(prompts))]
+
+
+def _batch_result_text(result: dict[str, Any]) -> str:
+    """Get the response text of one Batch API result line, or its error."""
+    response = result.get("response") or {}
+    body = response.get("body") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        error = result.get("error") or body.get("error") or body
+        if isinstance(error, dict):
+            error = error.get("message") or error
+        return f"Error: {error}"
+    return Response.model_validate(body).output_text
+
+
+def _read_text(path: str, size: int) -> str:
+    """Read a UTF-8 file of (roughly) known size with plain os-level calls."""
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        data = os.read(fd, size)
+        # Keep reading in case the file grew since it was stat'ed
+        while chunk := os.read(fd, 1 << 16):
+            data += chunk
+    finally:
+        os.close(fd)
+    return data.decode("utf-8")
+
+
+def _read_cached(path: str, mtime_ns: int, size: int) -> str:
+    """Read a UTF-8 file, reusing its text while mtime_ns and size match.
+
+    At most MAX_CACHE_BYTES of file contents are kept; the least recently read
+    files are dropped first.
+    """
+    global _read_cache_bytes
+
+    with _read_cache_lock:
+        cached = _read_cache.pop(path, None)
+        if cached is not None:
+            if cached[:2] == (mtime_ns, size):
+                _read_cache[path] = cached
+                return cached[2]
+            _read_cache_bytes -= cached[1]
+
+    text = _read_text(path, size)
+    with _read_cache_lock:
+        old = _read_cache.pop(path, None)
+        if old is not None:
+            _read_cache_bytes -= old[1]
+        _read_cache[path] = (mtime_ns, size, text)
+        _read_cache_bytes += size
+        while _read_cache_bytes > MAX_CACHE_BYTES:
+            _read_cache_bytes -= _read_cache.pop(next(iter(_read_cache)))[1]
+    return text
+
+
+def invalidate_memory_cache() -> None:
+    """Drop all cached memory listings and file contents."""
+    global _list_cache, _read_cache_bytes
+
+    _list_cache = None
+    with _read_cache_lock:
+        _read_cache.clear()
+        _read_cache_bytes = 0
+
+
+def _mem_root() -> str:
+    """Get MEM_DIR resolved, resolving again only if MEM_DIR is reassigned."""
+    global _mem_root_cache
+
+    if _mem_root_cache is None or _mem_root_cache[0] is not MEM_DIR:
+        _mem_root_cache = (MEM_DIR, os.path.realpath(MEM_DIR))
+    return _mem_root_cache[1]
+
+
+def _resolve_memory_path(path: str, strict: bool = not FAST_PATHS) -> str:
+    """Turn a path relative to the memory directory into an absolute one.
+
+    Args:
+        path: Path relative to the memory directory
+        strict: Resolve symlinks before checking containment
 
     Raises:
-        FileNotFoundError: If the file doesn't exist
-        UnicodeDecodeError: If the file isn't valid UTF-8
+        ValueError: If the path points outside the memory directory
     """
-    file_path = MEM_DIR / path
+    mem_root = _mem_root()
+    resolved = os.path.join(mem_root, path)
+    if strict:
+        resolved = os.path.realpath(resolved)
+    else:
+        resolved = os.path.normpath(resolved)
 
     # Security check: ensure the path is within memory directory
-    try:
-        file_path.resolve().relative_to(MEM_DIR.resolve())
-    except ValueError as e:
-        raise ValueError(f"Path outside memory directory: {path}") from e
+    if resolved != mem_root and not resolved.startswith(mem_root + os.sep):
+        raise ValueError(f"Path outside memory directory: {path}")
+    return resolved
+
 
-    if not file_path.exists():
-        raise FileNotFoundError(f"Memory file not found: {path}")
+def _read_memory_file(path: str) -> str:
+    """Read a memory file, validating that it lies within the memory directory."""
+    resolved = _resolve_memory_path(path)
+
+    # A single stat answers existence, type, and the cache key
+    try:
+        st = os.stat(resolved)
+    except (FileNotFoundError, NotADirectoryError) as e:
+        raise FileNotFoundError(f"Memory file not found: {path}") from e
 
-    if not file_path.is_file():
+    if not stat.S_ISREG(st.st_mode):
         raise ValueError(f"Path is not a file: {path}")
 
+    # Repeat reads of an unchanged file are served from the cache
     try:
-        return file_path.read_text(encoding="utf-8")
+        if st.st_size > MAX_CACHED_BYTES:
+            return _read_text(resolved, st.st_size)
+        return _read_cached(resolved, st.st_mtime_ns, st.st_size)
     except UnicodeDecodeError as e:
         raise UnicodeDecodeError(
             e.encoding,
@@ -76,22 +368,287 @@ def read_memory_file(path: str) -> str:
         ) from e
 
 
-async def main(prompt, model):
-    """Run the agent asynchronously."""
+def _listing_is_current(dir_mtimes: dict[str, int]) -> bool:
+    """Check that no directory seen by a previous scan has changed since.
+
+    Adding, removing or renaming an entry updates its parent directory's mtime,
+    so this catches any change to the listing with one stat per directory.
+    """
+    try:
+        return all(
+            os.stat(path).st_mtime_ns == mtime_ns
+            for path, mtime_ns in dir_mtimes.items()
+        )
+    except OSError:
+        return False
+
+
+def _list_memory_files() -> list[str]:
+    """List memory files, reusing the last scan while MEM_DIR is unchanged."""
+    global _list_cache
+
+    if not MEM_DIR.exists():
+        MEM_DIR.mkdir(exist_ok=True)
+        return []
+
+    # Reuse the previous scan until a directory in the memory tree is modified
+    mem_dir = str(MEM_DIR)
+    if (
+        _list_cache is not None
+        and mem_dir in _list_cache[0]
+        and _listing_is_current(_list_cache[0])
+    ):
+        return list(_list_cache[1])
+
+    dir_mtimes: dict[str, int] = {}
+    files = sorted(iter_memory_files(mem_dir, dir_mtimes))
+    _list_cache = (dir_mtimes, files)
+    return list(files)
+
+
+def _list_memory_dir(subpath: str, recursive: bool) -> list[str]:
+    """List one memory directory, or every file below it if recursive."""
+    # Always resolve symlinks here: like list_memory_files, listings never
+    # descend into directories outside the memory directory
+    target = _resolve_memory_path(subpath, strict=True)
+    prefix_len = len(_mem_root()) + 1
+    try:
+        if recursive:
+            # Paths from the walk are relative to target; make them relative
+            # to the memory directory like everything else
+            prefix = target[prefix_len:]
+            return sorted(
+                os.path.join(prefix, file) if prefix else file
+                for file in iter_memory_files(target)
+            )
+
+        names = []
+        with os.scandir(target) as entries:
+            for entry in entries:
+                if entry.name[0] == ".":
+                    continue
+                # Same rules as iter_memory_files, so both tools agree
+                if entry.is_dir(follow_symlinks=False):
+                    names.append(entry.path[prefix_len:] + "/")
+                elif entry.is_file():
+                    names.append(entry.path[prefix_len:])
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"Memory directory not found: {subpath}") from e
+    except NotADirectoryError as e:
+        raise ValueError(f"Path is not a directory: {subpath}") from e
+    names.sort()
+    return names
+
+
+def _truncate(text: str, limit: Optional[int] = None) -> str:
+    """Cap text at limit (MAX_TOOL_CHARS by default) so it can't bloat requests."""
+    if limit is None:
+        limit = MAX_TOOL_CHARS
+    if len(text) <= limit:
+        return text
+    omitted = len(text) - limit
+    return text[:limit] + f"\n...[truncated {omitted} characters]"
+
+
+def has_memory_files() -> bool:
+    """Check whether there are any memory files for the agent to use."""
+    return bool(_list_memory_files())
+
+
+# function tools
+# The filesystem work runs in a worker thread so that concurrent agent runs
+# sharing the event loop aren't blocked on disk I/O. Errors are raised rather
+# than turned into messages here, so that _dedupe_calls can tell failed calls
+# apart; it reports them to the model instead.
+@function_tool(failure_error_function=None)
+async def list_memory_files() -> list[str]:
+    """List all memory files recursively from the memory directory.
+
+    Returns:
+        List of relative file paths from the memory directory.
+    """
+    return await asyncio.to_thread(_list_memory_files)
+
+
+@function_tool(failure_error_function=None)
+async def list_memory_dir(subpath: str = "", recursive: bool = False) -> list[str]:
+    """List the files and subdirectories in one memory directory.
+
+    Cheaper than list_memory_files when the memory directory is large.
+
+    Args:
+        subpath: Directory relative to the memory directory, empty for the top
+        recursive: List every file below the directory instead of its entries
+
+    Returns:
+        Sorted paths relative to the memory directory; subdirectories end in "/".
+    """
+    return await asyncio.to_thread(_list_memory_dir, subpath, recursive)
+
+
+@function_tool(failure_error_function=None)
+async def read_memory_file(path: str) -> str:
+    """Read a memory file by its relative path.
+
+    Args:
+        path: Relative path from the memory directory
+
+    Returns:
+        File contents as UTF-8 string, truncated if very long
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+        UnicodeDecodeError: If the file isn't valid UTF-8
+    """
+    return _truncate(await asyncio.to_thread(_read_memory_file, path))
+
+
+@function_tool(failure_error_function=None)
+async def read_memory_files(paths: list[str]) -> dict[str, str]:
+    """Read several memory files at once by their relative paths.
+
+    Args:
+        paths: Relative paths from the memory directory
+
+    Returns:
+        Mapping of each path to its contents as UTF-8 string, or to an error
+        message if it couldn't be read. All contents together are capped at
+        MAX_TOOL_CHARS; files past the cap are truncated or left out
+    """
+
+    async def read(path: str) -> str:
+        try:
+            return await asyncio.to_thread(_read_memory_file, path)
+        except (OSError, ValueError) as e:
+            return f"Error: {e}"
+
+    # Each distinct path is read once, even if the model repeats it
+    unique_paths = list(dict.fromkeys(paths))
+    contents = await asyncio.gather(*(read(path) for path in unique_paths))
+
+    # Share one budget across files so the whole result stays bounded
+    budget = MAX_TOOL_CHARS
+    results = {}
+    for path, text in zip(unique_paths, contents):
+        if budget:
+            results[path] = _truncate(text, budget)
+            budget -= min(len(text), budget)
+        else:
+            results[path] = (
+                f"...[omitted {len(text)} characters; output limit reached, "
+                "read this file on its own]"
+            )
+    return results
+
+
+def _dedupe_calls(tool: FunctionTool) -> FunctionTool:
+    """Reuse the result of an identical earlier call to tool in the same run.
+
+    Results are kept in the run context when it is a dict; otherwise every call
+    is executed. Failed calls aren't kept, so the model can retry them, and are
+    reported to the model the way function_tool does by default.
+    """
+    invoke = tool.on_invoke_tool
+
+    async def on_invoke_tool(ctx: ToolContext[Any], arguments: str) -> Any:
+        try:
+            if not isinstance(ctx.context, dict):
+                return await invoke(ctx, arguments)
+
+            # Store the pending call so concurrent duplicates share it
+            key = (tool.name, arguments)
+            if key not in ctx.context:
+                ctx.context[key] = asyncio.ensure_future(invoke(ctx, arguments))
+            future = ctx.context[key]
+            try:
+                return await future
+            except Exception:
+                if ctx.context.get(key) is future:
+                    del ctx.context[key]
+                raise
+        except Exception as e:
+            return default_tool_error_function(ctx, e)
+
+    return dataclasses.replace(tool, on_invoke_tool=on_invoke_tool)
+
+
+# Tools given to the agent; run it with a dict context to dedupe repeated calls
+MEMORY_TOOLS = [
+    _dedupe_calls(tool)
+    for tool in (
+        list_memory_files,
+        list_memory_dir,
+        read_memory_file,
+        read_memory_files,
+    )
+]
+
+
+async def agent_response(prompt: str, model: str = "gpt-4.1") -> RunResult:
+    """Run the memory-augmented agent on a prompt."""
     agent = Agent(
         name="funes",
         instructions="""You are a helpful assistant that can access additional information stored in memory files. 
         You should ALWAYS call the list_memory_files tool to see if any are relevant to the user's query. 
-        If you find relevant files, use the read_memory_file tool to read their contents.""",
-        tools=[list_memory_files, read_memory_file],
-        model=model,
+        If you find relevant files, use the read_memory_file tool to read their contents,
+        or the read_memory_files tool to read several of them at once.
+        If there are many memory files, use the list_memory_dir tool to browse
+        one directory at a time.""",
+        tools=MEMORY_TOOLS,
+        model=OpenAIResponsesModel(model=model, openai_client=get_client()),
     )
 
     runner = Runner()
-    response = await runner.run(
+    return await runner.run(
         agent,
         input=prompt,
+        context={},
+    )
+
+
+async def run_many(
+    prompts: list[str], model: str = "gpt-4.1", concurrency: int = 8
+) -> list[tuple[str, Union[RunResult, Exception]]]:
+    """Run the baseline and the agent over many prompts.
+
+    Baselines go through the Batch API while the agent runs concurrently, at
+    most `concurrency` prompts at a time.
+
+    Returns:
+        (baseline text, agent result) pairs, in the same order as prompts. A
+        failed baseline request gives "Error: <reason>" as its text, and a
+        failed agent run gives the exception it raised in place of its result.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited_agent_response(prompt: str) -> Union[RunResult, Exception]:
+        async with semaphore:
+            try:
+                return await agent_response(prompt, model=model)
+            except Exception as e:
+                # Keep the other prompts' results, including the paid batch
+                return e
+
+    bases, responses = await asyncio.gather(
+        batch_base_responses(prompts, model=model),
+        asyncio.gather(*(limited_agent_response(p) for p in prompts)),
     )
+    return list(zip(bases, responses))
+
+
+async def main(prompt, model):
+    """Run the baseline and the agent concurrently."""
+    if not await asyncio.to_thread(has_memory_files):
+        print("Baseline Response:", await base_response(prompt, model=model))
+        print("No memory files found, skipping the agent")
+        return
+
+    base, response = await asyncio.gather(
+        base_response(prompt, model=model),
+        agent_response(prompt, model=model),
+    )
+    print("Baseline Response:", base)
+    print("========================")
 
     output_text = response.final_output
     new_items = response.new_items
@@ -106,8 +663,4 @@ if __name__ == "__main__":
     MODEL = "gpt-4.1"
     PROMPT = "What is a good library for data visualization?"
 
-    base = base_response(PROMPT, model=MODEL)
-    print("Baseline Response:", base)
-    print("========================")
-
     asyncio.run(main(PROMPT, MODEL))
@@ -4,7 +4,7 @@ Launch script for the Funes Agent UI.
 Run this script to start the Streamlit web interface.
 """
 
-import subprocess
+import os
 import sys
 from pathlib import Path
 
@@ -21,15 +21,18 @@ def main():
     print("The web interface will open in your browser automatically.")
     print("Press Ctrl+C to stop the server.")
     
+    # Replace this process with Streamlit rather than waiting on a child. exec
+    # discards Python's buffers, so flush the banner first (stdout is block
+    # buffered when piped).
+    sys.stdout.flush()
+    sys.stderr.flush()
     try:
-        subprocess.run([
+        os.execv(sys.executable, [
             sys.executable, "-m", "streamlit", "run", str(app_path),
             "--server.headless", "false",
             "--server.port", "8501"
         ])
-    except KeyboardInterrupt:
-        print("\nShutting down server...")
-    except Exception as e:
+    except OSError as e:
         print(f"Error running Streamlit: {e}")
         sys.exit(1)
 